@@ -1,25 +1,126 @@
+from contextlib import contextmanager
 from fastmcp import FastMCP
+from functools import lru_cache
 import os
 import sqlite3
+import threading
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "expenses.db")
 CATEGORIES_PATH = os.path.join(os.path.dirname(__file__), "categories.json")
+# Set to 0 to disable memory-mapped I/O (e.g. containers with restricted VM)
+MMAP_SIZE = int(os.environ.get("EXPENSES_DB_MMAP_SIZE", 268435456))
 
 mcp = FastMCP("ExpenseTracker")
 
+# Plain INTEGER PRIMARY KEY (no AUTOINCREMENT) skips a sqlite_sequence update per
+# insert, at a cost: deleting the newest row lets the next insert reuse its id,
+# so a client holding a stale id from before the delete can edit or delete the
+# replacement expense instead.
+_SQL_CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS {table}(
+        id INTEGER PRIMARY KEY,
+        date TEXT NOT NULL,
+        amount REAL NOT NULL,
+        category TEXT NOT NULL,
+        subcategory TEXT DEFAULT '',
+        note TEXT DEFAULT ''
+    )
+"""
+_SQL_INSERT = "INSERT INTO expenses(date, amount, category, subcategory, note) VALUES (?,?,?,?,?)"
+# RETURNING (SQLite 3.35+) hands back the new id from the INSERT itself
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+_SQL_INSERT_RETURNING = _SQL_INSERT + " RETURNING id"
+# Rows are encoded to a JSON array inside SQLite; the subquery fixes the order.
+# json_object() writes REAL values with 15 significant digits, so amounts
+# beyond that precision come back rounded (ample for currency values).
+_SQL_LIST = """
+    SELECT json_group_array(json_object(
+        'id', id, 'date', date, 'amount', amount,
+        'category', category, 'subcategory', subcategory, 'note', note
+    ))
+    FROM (
+        SELECT id, date, amount, category, subcategory, note
+        FROM expenses
+        WHERE date BETWEEN ? AND ?
+        ORDER BY id ASC
+    )
+"""
+_SQL_SUMMARIZE_ALL = """
+    SELECT json_group_array(json_object('category', category, 'total_amount', total_amount))
+    FROM (
+        SELECT category, SUM(amount) AS total_amount
+        FROM expenses
+        WHERE date BETWEEN ? AND ?
+        GROUP BY category ORDER BY category ASC
+    )
+"""
+_SQL_SUMMARIZE_CAT = """
+    SELECT json_group_array(json_object('category', category, 'total_amount', total_amount))
+    FROM (
+        SELECT category, SUM(amount) AS total_amount
+        FROM expenses
+        WHERE date BETWEEN ? AND ? AND category = ?
+        GROUP BY category ORDER BY category ASC
+    )
+"""
+_SQL_DELETE = "DELETE FROM expenses WHERE id = ?"
+
+_EDIT_FIELDS = ("date", "amount", "category", "subcategory", "note")
+# UPDATE statements keyed by the bitmask of fields being set, built on first use
+_EDIT_STMTS = {}
+
+# Contents of categories.json, keyed on its modification time
+_CAT_CACHE = {"mtime": None, "data": ""}
+
+# One long-lived connection shared by every tool; opened in init_db()
+_CONN = None
+_LOCK = threading.Lock()
+
+
+@contextmanager
+def _db():
+    """Serialize access to the shared connection. Single statements autocommit."""
+    with _LOCK:
+        yield _CONN
+
+
+@contextmanager
+def _transaction():
+    """Like _db(), but wraps the block in BEGIN IMMEDIATE ... COMMIT, rolling back on error."""
+    with _LOCK:
+        _CONN.execute("BEGIN IMMEDIATE")
+        try:
+            yield _CONN
+            _CONN.execute("COMMIT")
+        except BaseException:
+            # SQLite may already have rolled back on its own (e.g. SQLITE_FULL)
+            if _CONN.in_transaction:
+                _CONN.execute("ROLLBACK")
+            raise
+
 
 def init_db():
-    with sqlite3.connect(DB_PATH) as c:
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS expenses(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL,
-                amount REAL NOT NULL,
-                category TEXT NOT NULL,
-                subcategory TEXT DEFAULT '',
-                note TEXT DEFAULT ''
-            )
-        """)
+    global _CONN
+    _CONN = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=512)
+    _CONN.execute("PRAGMA journal_mode=WAL")
+    _CONN.execute("PRAGMA synchronous=NORMAL")
+    _CONN.execute("PRAGMA temp_store=MEMORY")
+    _CONN.execute("PRAGMA cache_size=-64000")
+    _CONN.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    with _transaction() as c:
+        row = c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'expenses'").fetchone()
+        if row and "AUTOINCREMENT" in row[0].upper():
+            # Older databases used AUTOINCREMENT, which costs a sqlite_sequence update per insert
+            c.execute(_SQL_CREATE_TABLE.format(table="expenses_new"))
+            c.execute("""
+                INSERT INTO expenses_new(id, date, amount, category, subcategory, note)
+                SELECT id, date, amount, category, subcategory, note FROM expenses
+            """)
+            c.execute("DROP TABLE expenses")
+            c.execute("ALTER TABLE expenses_new RENAME TO expenses")
+            c.execute("DELETE FROM sqlite_sequence WHERE name = 'expenses'")
+        c.execute(_SQL_CREATE_TABLE.format(table="expenses"))
+        c.execute("CREATE INDEX IF NOT EXISTS idx_expenses_date_cat ON expenses(date, category)")
 
 
 init_db()
@@ -28,99 +129,121 @@ init_db()
 @mcp.tool()
 def add_expense(date, amount, category, subcategory="", note=""):
     """Add a new expense entry to the database."""
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute(
-            "INSERT INTO expenses(date, amount, category, subcategory, note) VALUES (?,?,?,?,?)",
-            (date, amount, category, subcategory, note)
-        )
-        return {"status": "ok", "id": cur.lastrowid}
+    row = (date, amount, category, subcategory, note)
+    with _db() as c:
+        if _HAS_RETURNING:
+            # fetchall() steps the INSERT to completion so it commits right away
+            expense_id = c.execute(_SQL_INSERT_RETURNING, row).fetchall()[0][0]
+        else:
+            expense_id = c.execute(_SQL_INSERT, row).lastrowid
+        return {"status": "ok", "id": expense_id}
+
+
+@mcp.tool()
+def add_expenses_bulk(items: list[dict]):
+    """Add many expense entries in a single transaction.
+
+    Each item is an object with date, amount, category and optional subcategory and note.
+    """
+    if not items:
+        return {"status": "error", "message": "No items provided"}
+
+    rows = []
+    for n, i in enumerate(items):
+        try:
+            rows.append((i["date"], i["amount"], i["category"], i.get("subcategory", ""), i.get("note", "")))
+        except KeyError as e:
+            return {"status": "error", "message": f"Item {n} is missing field: {e.args[0]}"}
+
+    try:
+        with _transaction() as c:
+            cur = c.executemany(_SQL_INSERT, rows)
+            last_id = c.execute("SELECT last_insert_rowid()").fetchone()[0]
+    except (sqlite3.IntegrityError, sqlite3.ProgrammingError) as e:
+        return {"status": "error", "message": str(e)}
+
+    return {
+        "status": "ok",
+        "rows_inserted": cur.rowcount,
+        "first_id": last_id - cur.rowcount + 1,
+        "last_id": last_id,
+    }
 
 
 @mcp.tool()
 def list_expenses(start_date, end_date):
-    """List expense entries within an inclusive date range."""
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute(
-            """
-            SELECT id, date, amount, category, subcategory, note
-            FROM expenses
-            WHERE date BETWEEN ? AND ?
-            ORDER BY id ASC
-            """,
-            (start_date, end_date)
-        )
-        cols = [d[0] for d in cur.description]
-        return [dict(zip(cols, r)) for r in cur.fetchall()]
+    """List expense entries within an inclusive date range.
+
+    Returns a JSON array; amounts are rounded to 15 significant digits.
+    """
+    with _db() as c:
+        return c.execute(_SQL_LIST, (start_date, end_date)).fetchone()[0]
+
+
+@lru_cache(maxsize=256)
+def _summarize_cached(start_date, end_date, category, tag):
+    # tag only feeds the cache key; callers hold _LOCK while calling this
+    if category:
+        cur = _CONN.execute(_SQL_SUMMARIZE_CAT, (start_date, end_date, category))
+    else:
+        cur = _CONN.execute(_SQL_SUMMARIZE_ALL, (start_date, end_date))
+    return cur.fetchone()[0]
 
 
 @mcp.tool()
 def summarize(start_date, end_date, category=None):
-    """Summarize expenses by category within an inclusive date range."""
-    with sqlite3.connect(DB_PATH) as c:
-        query = """
-            SELECT category, SUM(amount) AS total_amount
-            FROM expenses
-            WHERE date BETWEEN ? AND ?
-        """
-        params = [start_date, end_date]
+    """Summarize expenses by category within an inclusive date range.
 
-        if category:
-            query += " AND category = ?"
-            params.append(category)
+    Returns a JSON array; totals are rounded to 15 significant digits.
+    """
+    with _db() as c:
+        # Changes on this connection bump total_changes; commits from any other
+        # connection bump data_version. Either one invalidates cached totals.
+        tag = (c.total_changes, c.execute("PRAGMA data_version").fetchone()[0])
+        return _summarize_cached(start_date, end_date, category or None, tag)
 
-        query += " GROUP BY category ORDER BY category ASC"
 
-        cur = c.execute(query, params)
-        cols = [d[0] for d in cur.description]
-        return [dict(zip(cols, r)) for r in cur.fetchall()]
+def _edit_stmt(mask):
+    query = _EDIT_STMTS.get(mask)
+    if query is None:
+        fields = [f"{name} = ?" for i, name in enumerate(_EDIT_FIELDS) if mask & (1 << i)]
+        query = _EDIT_STMTS[mask] = f"UPDATE expenses SET {', '.join(fields)} WHERE id = ?"
+    return query
 
 
 @mcp.tool()
 def edit_expense(expense_id, date=None, amount=None, category=None, subcategory=None, note=None):
     """Edit an existing expense by ID. Only provided fields will be updated."""
-    with sqlite3.connect(DB_PATH) as c:
-        fields = []
-        params = []
-
-        if date is not None:
-            fields.append("date = ?")
-            params.append(date)
-        if amount is not None:
-            fields.append("amount = ?")
-            params.append(amount)
-        if category is not None:
-            fields.append("category = ?")
-            params.append(category)
-        if subcategory is not None:
-            fields.append("subcategory = ?")
-            params.append(subcategory)
-        if note is not None:
-            fields.append("note = ?")
-            params.append(note)
-
-        if not fields:
-            return {"status": "error", "message": "No fields provided to update"}
-
-        params.append(expense_id)
-        query = f"UPDATE expenses SET {', '.join(fields)} WHERE id = ?"
-        cur = c.execute(query, params)
+    values = (date, amount, category, subcategory, note)
+    mask = sum(1 << i for i, v in enumerate(values) if v is not None)
+
+    if not mask:
+        return {"status": "error", "message": "No fields provided to update"}
+
+    params = [v for v in values if v is not None]
+    params.append(expense_id)
 
+    with _db() as c:
+        cur = c.execute(_edit_stmt(mask), params)
         return {"status": "ok", "rows_updated": cur.rowcount}
 
 
 @mcp.tool()
 def delete_expense(expense_id):
     """Delete an expense by ID."""
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
+    with _db() as c:
+        cur = c.execute(_SQL_DELETE, (expense_id,))
         return {"status": "ok", "rows_deleted": cur.rowcount}
 
 
 @mcp.resource("expense://categories", mime_type="application/json")
 def categories():
-    # Read fresh each time so you can edit the file without restarting
-    with open(CATEGORIES_PATH, "r", encoding="utf-8") as f:
-        return f.read()
+    # Re-read only when the file changes so you can edit it without restarting
+    mtime = os.stat(CATEGORIES_PATH).st_mtime_ns
+    if mtime != _CAT_CACHE["mtime"]:
+        with open(CATEGORIES_PATH, "r", encoding="utf-8") as f:
+            _CAT_CACHE.update(mtime=mtime, data=f.read())
+    return _CAT_CACHE["data"]
 
 
 if __name__ == "__main__":